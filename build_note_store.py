@@ -0,0 +1,24 @@
+####################################################
+# Packs the parsed notes of every midi file in an input folder
+# into the memory mapped note store parse_midi's workers read from
+#
+# usage: python build_note_store.py [input folder]
+####################################################
+
+import os
+import sys
+from parse_midi import IN_PATH, NOTE_STORE_PATH, buildNoteStore
+
+# folder of midi files to pack, from the command line or parse_midi's input folder
+if len(sys.argv) > 1:
+	inPath = os.path.join(sys.argv[1], "")
+else:
+	inPath = IN_PATH
+
+filenames = [inPath + f for f in sorted(os.listdir(inPath)) if f.split(".")[-1].lower() == "mid"]
+
+print "Packing " + str(len(filenames)) + " files..."
+
+numSongs = buildNoteStore(NOTE_STORE_PATH, filenames)
+
+print str(numSongs) + " songs written to the note store " + NOTE_STORE_PATH
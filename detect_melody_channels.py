@@ -0,0 +1,59 @@
+####################################################
+# Detects the melody channel of every midi file in an input folder,
+# in parallel, and caches them for parse_midi's melody output
+#
+# usage: python detect_melody_channels.py [workers] [input folder]
+####################################################
+
+import os
+import sys
+import multiprocessing
+from parse_midi import IN_PATH, MELODY_CHANNEL_FILE, melodyChannels, getFileHash, getMelodyChannel, loadMelodyChannels, saveMelodyChannels
+
+def detectFile(filename):
+	'''returns a midi file's name, hash and melody channel, detecting the channel if it isn't cached'''
+
+	fileHash = getFileHash(filename)
+
+	return filename, fileHash, getMelodyChannel(filename,fileHash)
+
+# number of worker processes, from the command line or one per core
+if len(sys.argv) > 1:
+	numWorkers = int(sys.argv[1])
+else:
+	numWorkers = multiprocessing.cpu_count()
+
+# folder of midi files, from the command line or parse_midi's input folder
+if len(sys.argv) > 2:
+	inPath = os.path.join(sys.argv[2], "")
+else:
+	inPath = IN_PATH
+
+filenames = [inPath + f for f in sorted(os.listdir(inPath)) if f.split(".")[-1].lower() == "mid"]
+
+# the workers start with the channels detected before, so they only detect new files
+loadMelodyChannels(MELODY_CHANNEL_FILE)
+
+print "Detecting melody channels of " + str(len(filenames)) + " files with " + str(numWorkers) + " workers..."
+print
+
+pool = multiprocessing.Pool(numWorkers)
+
+# how many files have their melody on each channel
+counts = {}
+
+for filename, fileHash, melodyChannel in pool.imap_unordered(detectFile, filenames, 1):
+
+	melodyChannels[fileHash] = melodyChannel
+	counts[melodyChannel] = counts.get(melodyChannel,0) + 1
+
+	print filename + ": " + str(melodyChannel)
+
+pool.close()
+pool.join()
+
+saveMelodyChannels(MELODY_CHANNEL_FILE)
+
+print
+for melodyChannel in sorted(counts):
+	print "channel " + str(melodyChannel) + ": " + str(counts[melodyChannel]) + " files"
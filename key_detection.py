@@ -1,12 +1,15 @@
 ####################################################
-# Renames all files to include their detected key
+# Copies all files to a folder, renamed to include their detected key
+# (parse_midi.py detects the key itself as it parses,
+# so this is only for sorting the files by key)
 #
 # Andy Wiggins
 ####################################################
 
-import music21
 import numpy as np
 import os
+import shutil
+from parse_midi import parseMidi
 
 # Set input and output paths
 inPath = "GeerdesMIDI/"
@@ -29,14 +32,18 @@ for filename in filelist[2:]:
 	# if it's midi file
 	if fileExt.lower() == "mid":
 
-		# import the score as a music21 file
-		score21 = music21.converter.parse(inPath + filename)
+		# parse the notes into a note table
+		# Krumhasl key analysis to predict song key is done as the notes are parsed
+		# (matches music21's analyze('Krumhansl') on quantized files, check with verify_keys.py)
+		score = parseMidi(inPath + filename,True)
+		songKey = score.key
 
-		# Krumhasl key analysis to predict song key
-		key21 = score21.analyze('Krumhansl')
+		# skip files without notes, they have no key
+		if songKey is None:
+			continue
 
 		# create string of letter name + mode
-		songKey = str(key21.tonic.name) + "_" + str(key21.mode)
+		songKey = songKey[0] + "_" + songKey[1]
 
 		# cut off the .mid part of the name
 		name_no_ext = filename.split(".")[0]
@@ -46,8 +53,8 @@ for filename in filelist[2:]:
 		# get file destination
 		dst = outPath + new_name + ".MID"
 
-		# rename the file accordingly
-		os.rename(inPath + filename, dst)
+		# copy the file under its new name, the input folder is parse_midi.py's input too
+		shutil.copy2(inPath + filename, dst)
 
 		print i
 
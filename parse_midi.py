@@ -3,20 +3,45 @@
 # MIDI 2 unitized CSV
 #######################
 
+import time
+
+# when the module started loading, so main can check imports against the startup budget
+loadStart = time.time()
+
 from mido import MidiFile
 import os
+import sys
 import numpy as np
 import csv
-import music21
 import shutil
-
-class Score:
-
-	def __init__(self, name, notes, length, key):
+import multiprocessing
+import math
+import itertools
+from fractions import Fraction
+import cPickle as pickle
+import hashlib
+import json
+import traceback
+from collections import OrderedDict
+
+# seconds the imports above may take, music21 alone takes more than this so it's only imported where it's used
+STARTUP_BUDGET = 0.5
+loadTime = time.time() - loadStart
+
+class Score(object):
+
+	__slots__ = ('name','notes','length','key','ticksPerMeasure','noteIndex')
+
+	# note starts and durations, and the length, are in midi ticks from the first note
+	def __init__(self, name, notes, length, key, ticksPerMeasure):
 		self.name = name
 		self.notes = notes
 		self.length = length
 		self.key = key
+		self.ticksPerMeasure = ticksPerMeasure
+
+		# built the first time the score is queried by time, see getNoteIndex
+		self.noteIndex = None
 
 	def __str__(self):
 		s = "----score----"
@@ -26,11 +51,13 @@ class Score:
 			s += str(n)
 			s += "\n"
 		s = s[:-1]
-		s += "\nlength: " + str(self.length) + " measures"
+		s += "\nlength: " + str(float(self.length) / self.ticksPerMeasure) + " measures"
 		s += "\nlength: " + str(self.key)
 		return s
 
-class Note:
+class Note(object):
+
+	__slots__ = ('pitch','start','duration','channel')
 
 	def __init__(self, pitch, start, duration, channel):
 		self.pitch = pitch
@@ -46,122 +73,217 @@ class Note:
 		s += "\n\tchannel: " + str(self.channel)
 		return s
 
-class HarmUnit:
+class HarmUnit(object):
 
+	__slots__ = ('chordNotes','chordName')
+
+	# units are shared between every unit with the same pitches, so treat them as read only
 	def __init__(self, chordNotes, chordName):
-		self.chordNotes = chordNotes
-		self.chordName = chordName
+		self.chordNotes = intern(chordNotes)
+		self.chordName = intern(chordName)
 		
+# columns of a note table, a structured array with one row per note
+# starts and durations are in ticks, so binning notes into units is integer division
+NOTE_DTYPE = np.dtype([('pitch',np.uint8),('start',np.int64),('duration',np.int64),('channel',np.uint8)])
+
+def getNoteTable(score):
+	'''returns the notes of a score as a note table, building one if the score holds Note objects'''
+
+	if isinstance(score.notes, np.ndarray):
+		return score.notes
+
+	return np.array([(n.pitch,n.start,n.duration,n.channel) for n in score.notes], dtype=NOTE_DTYPE)
+
+class NoteIndex:
+	'''the notes of a score sorted by start, and bucketed by the measures they sound in, for time window queries'''
+
+	def __init__(self, notes, ticksPerMeasure):
+
+		self.notes = notes
+		self.ticksPerMeasure = ticksPerMeasure
+
+		starts = notes['start']
+		ends = starts + notes['duration']
+
+		# the notes in start order, for notes starting in a window
+		self.order = np.argsort(starts, kind='mergesort')
+		self.starts = starts[self.order]
+
+		# the measures each note sounds in, at least the one it starts in
+		firstMeasures = starts // ticksPerMeasure
+		lastMeasures = np.maximum((ends - 1) // ticksPerMeasure, firstMeasures)
+		counts = lastMeasures - firstMeasures + 1
+
+		# one entry per note per measure, grouped by measure
+		noteIndex = np.repeat(np.arange(len(notes)), counts)
+		measures = firstMeasures[noteIndex] + np.arange(len(noteIndex)) - np.repeat(np.cumsum(counts) - counts, counts)
+		byMeasure = np.argsort(measures, kind='mergesort')
+
+		# the notes sounding in measure m are bucketNotes[bucketOffsets[m]:bucketOffsets[m+1]]
+		self.bucketNotes = noteIndex[byMeasure]
+		self.bucketOffsets = np.concatenate([[0], np.cumsum(np.bincount(measures, minlength=1))])
+
+	def getStarting(self, start, end):
+		'''returns the indices of the notes that start in [start, end) ticks, in start order'''
+
+		first, last = np.searchsorted(self.starts, [start, end], side='left')
+
+		return self.order[first:last]
+
+	def getSounding(self, start, end):
+		'''returns the indices of the notes that sound at some point in [start, end) ticks, in score order'''
+
+		# the buckets of the measures the window touches, clipped to the measures we have
+		numMeasures = len(self.bucketOffsets) - 1
+		firstMeasure = min(max(start // self.ticksPerMeasure, 0), numMeasures)
+		lastMeasure = min(max(-(-end // self.ticksPerMeasure), firstMeasure), numMeasures)
+		candidates = np.unique(self.bucketNotes[self.bucketOffsets[firstMeasure]:self.bucketOffsets[lastMeasure]])
+
+		# a note sounds in the window if it starts before the window ends and ends after it starts,
+		# a note with no duration if it starts in the window
+		starts = self.notes['start'][candidates]
+		ends = starts + self.notes['duration'][candidates]
+
+		return candidates[(starts < end) & ((ends > start) | (starts >= start))]
+
+def getNoteIndex(score):
+	'''returns the note index of a score, building it the first time'''
+
+	if score.noteIndex is None:
+		score.noteIndex = NoteIndex(getNoteTable(score), score.ticksPerMeasure)
+
+	return score.noteIndex
+
+# names of the 128 midi pitches, worked out once
+# melody units spell every black key as a sharp
+MELODY_PITCH_NAMES = [['C','C#','D','D#','E','F','F#','G','G#','A','A#','B'][p % 12] + str((p // 12) - 1) for p in range(128)]
+
+# harmony units use music21's nameWithOctave, which spells E-, B- as flats and leaves the octave off below C0
+HARMONY_PITCH_NAMES = [['C','C#','D','E-','E','F','F#','G','G#','A','B-','B'][p % 12] + (str((p // 12) - 1) if p >= 12 else "") for p in range(128)]
+
+# names of the units of a melody, a note starting, a note continuing, and a rest
+MELODY_UNIT_NAMES = np.array([name + ":+" for name in MELODY_PITCH_NAMES] + [name + ":-" for name in MELODY_PITCH_NAMES] + ["0"], dtype=object)
+
 def pitchStr(note):
 	'''returns the string of the note name given a midi note val'''
-	alpha = ['C','C#','D','D#','E','F','F#','G','G#','A','A#','B']
-	octave = str((note // 12) - 1)
-	noteIndex = note % 12
-	return alpha[noteIndex] + octave
+	return MELODY_PITCH_NAMES[note]
 
 def noteinKey(note,key):
 	'''returns an int in [1,11] for a note given a key'''
 
-def getKeyFromName(filename):
-	'''retrieves the song key and mode from the title of the midi file'''
+# Krumhansl's key profiles, tonic first, weighted the way music21's 'Krumhansl' analysis weights them
+KEY_PROFILES = {
+	"major": np.array([6.35, 2.33, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]),
+	"minor": np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])}
 
-	# split name by T- to get the key separated out, split at . remove file ext
-	# split at _ to seperate key letter and mode
+# how music21 spells the tonic of each key, by pitch class
+KEY_TONICS = {
+	"major": ['C','C#','D','E-','E','F','F#','G','A-','A','B-','B'],
+	"minor": ['C','C#','D','E-','E','F','F#','G','G#','A','B-','B']}
 
-	# take off ".mid"
-	noex = filename[:-4]
+def getPitchClassProfile(score):
+	'''returns how long each pitch class sounds in a score'''
 
-	# major or minor
-	mode = noex[-5:]
+	notes = getNoteTable(score)
 
-	letters = ["A","B","C","D","E","F","G"]
+	return np.bincount(notes['pitch'] % 12, weights=notes['duration'], minlength=12)
 
-	# no sharp or flat
-	if noex[-7] in letters:
-		keyLet = noex[-7]
+def detectKey(score):
+	'''estimates the key and mode of a score the way music21's Krumhansl analysis does, or None if it has no notes'''
 
-	else:
-		keyLet = noex[-8:-6]
+	if len(score.notes) == 0:
+		return None
+
+	profile = getPitchClassProfile(score)
+
+	# row i of a key profile matrix is the profile of the key with tonic i
+	rotations = (np.arange(12)[np.newaxis,:] - np.arange(12)[:,np.newaxis]) % 12
 
-	key = [keyLet,mode]
+	candidates = []
 
-	# key = filename.split("T-")[1].split(".")[0].split("_")
-	return key
+	for mode in ["major","minor"]:
 
-def parseMidi(filename):
-	'''creates a score object for a midi file'''
+		keyProfiles = KEY_PROFILES[mode][rotations]
+
+		# how well each key fits, and the correlation of each key's profile with the song's
+		fits = np.dot(keyProfiles, profile)
+		keyDeviations = keyProfiles - keyProfiles.mean(axis=1)[:,np.newaxis]
+		deviations = profile - profile.mean()
+		denominators = np.sqrt((keyDeviations ** 2).sum(axis=1) * (deviations ** 2).sum())
+		correlations = np.dot(keyDeviations, deviations) / np.where(denominators == 0, 1, denominators)
+		correlations[denominators == 0] = 0
+
+		# music21 looks tonics up by their fit, so of two tonics that fit equally only the first is a candidate
+		fits = fits.tolist()
+		for tonic in set([fits.index(fit) for fit in fits]):
+			candidates.append((correlations[tonic],tonic,mode))
+
+	# the best correlated key, ties going to the higher tonic and then to minor
+	correlation, tonic, mode = max(candidates)
+
+	return [KEY_TONICS[mode][tonic],mode]
+
+def parseMidi(filename,noteTable=False):
+	'''creates a score object for a midi file, with its notes as Note objects or as a note table'''
 
 	# load the midi file
 	mid = MidiFile(filename)
 
-	# list of started notes
+	# starts of the started notes, by (channel,pitch)
 	startedNotes = {}
 
-	# list of completed notes
+	# list of completed notes, as (pitch, start, duration, channel)
 	notes = []
 
-	# set bool for song started
-	songStarted = False
-
-	# current measure number
-	currentMeasureNumber = 0
+	# tick of the first note, where the song starts
+	startTick = None
 
-	# get the ticks per unit
-	# unit is the denominator of note value
-	# ex: 8 for eigth note, 16 for sixteenth note
-	ticksPerMeasure = mid.ticks_per_beat * 4.0
+	# ticks since the first note
+	currentTick = 0
 
-	# set a default tempo
-	tempo = 500000
+	# get the ticks per measure, unit sizes are converted to ticks with it
+	ticksPerMeasure = mid.ticks_per_beat * 4
 
 	# start with blank name
 	name = ""
 	nameSet = False
 
-	# iterate through all messages in the midi file
-	for message in mid:
-
-		mess = message.dict()
-
-		###################
-		# print mess
-		###################
+	# merge the tracks in absolute ticks, in the same order mido plays them back
+	# (by tick, ties in track order)
+	events = []
+	for track in mid.tracks:
+		tick = 0
+		for message in track:
+			tick += message.time
+			events.append((tick,message))
+	events.sort(key=lambda e: e[0])
 
-		dtime = mess['time']
-		mtype = mess['type']
-
-		# only after the song has started do we count ticks and units
-		if songStarted:
-
-			# convert dtime (seconds) to ticks via tempo (microseconds/beat) and ticks per beat
-			dticks = int(round(dtime * 1000000 * (1.0 / tempo) * mid.ticks_per_beat))	
+	# iterate through all messages in the midi file
+	for tick, message in events:
 
-			# update current measure number based on the number of ticks that passed
-			currentMeasureNumber += (dticks / ticksPerMeasure)
+		mtype = message.type
 
-		# check if the tempo changed and update
-		if mtype == 'set_tempo':
-			tempo = mess['tempo']
+		# only after the song has started do we count ticks
+		if startTick is not None:
+			currentTick = tick - startTick
 
 		# store the track name, if in midi file
-		elif mtype == 'lyrics' and nameSet == False:
-			name = mess['text']
+		if mtype == 'lyrics' and nameSet == False:
+			name = message.text
 			nameSet = True
 
 		# if the message is a non zero velocity note on, store it in started notes
-		elif mtype == 'note_on' and mess['velocity'] != 0:
+		elif mtype == 'note_on' and message.velocity != 0:
 
 			# start the song ticker
-			if not songStarted:
-				songStarted = True
+			if startTick is None:
+				startTick = tick
 
 			# get the parameters of the note
-			# duration is zero till we have a note off
-			pitch = mess['note']
-			# round it 8 decimal places
-			start = round(currentMeasureNumber,8)
-			duration = 0
-			channel = mess['channel']
+			# duration comes when we have a note off
+			pitch = message.note
+			start = currentTick
+			channel = message.channel
 
 			# get the dict key
 			key = (channel,pitch)
@@ -172,17 +294,17 @@ def parseMidi(filename):
 				# create an empty list in the dict for this key
 				startedNotes[key] = []
 
-			# append the new note 
-			startedNotes[key].append(Note(pitch,start,duration,channel))
+			# append the new note's start
+			startedNotes[key].append(start)
 
 		# if the message is a note off, find and remove the started note,
 		# compute duration, and store the output note 
-		elif mtype == 'note_off' or (mtype == 'note_on' and mess['velocity'] == 0):
+		elif mtype == 'note_off' or (mtype == 'note_on' and message.velocity == 0):
 
 			# get the parameters of the note
-			pitch = mess['note']
-			end = currentMeasureNumber
-			channel = mess['channel']
+			pitch = message.note
+			end = currentTick
+			channel = message.channel
 
 			# get the dict key
 			key = (channel,pitch)
@@ -195,8 +317,8 @@ def parseMidi(filename):
 			# get the list of started notes with the key
 			noteList = startedNotes[key]
 
-			# get the first note from the list 
-			n = noteList.pop(0)
+			# get the first note's start from the list 
+			start = noteList.pop(0)
 
 			# if the note list is empty, remove the key from the dict
 			if noteList == []:
@@ -204,26 +326,574 @@ def parseMidi(filename):
 				# delete the key
 				del startedNotes[key]
 
-			# compute and store its duration
-			# round 8 decimal places
-			n.duration = round(end - n.start,8)
+			# compute its duration
+			duration = end - start
 
 			# add the completed note to completed notes
-			notes.append(n)
+			notes.append((pitch,start,duration,channel))
+
+	# at the end, the current tick is the length of the score
+	length = currentTick
+
+	# store the notes as a note table or as note objects
+	if noteTable:
+		notes = np.array(notes, dtype=NOTE_DTYPE)
+	else:
+		notes = [Note(*n) for n in notes]
+
+	# create a new score object
+	score = Score(name,notes,length,None,ticksPerMeasure)
+
+	# detect the key from the notes we just parsed, it stays with the score instead of going in the file name
+	score.key = detectKey(score)
+
+	return score
+
+# bump whenever parseMidi's output changes, so scores parsed by an older version aren't reused
+PARSER_VERSION = 3
+
+# parsed scores, by midi file contents
+SCORE_CACHE_PATH = "score_cache/"
+
+def getTempFilename(filename):
+	'''returns a temp filename next to a file, unique to this process, to write before renaming it over the file'''
+
+	return filename + "." + str(os.getpid()) + ".tmp"
+
+def getFileHash(filename):
+	'''returns the sha1 hex digest of a file's contents'''
+
+	h = hashlib.sha1()
+
+	with open(filename, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), ""):
+			h.update(block)
+
+	return h.hexdigest()
+
+def loadScore(filename,fileHash=None):
+	'''returns the score for a midi file with a note table, from the score cache if the file was parsed before'''
+
+	if fileHash is None:
+		fileHash = getFileHash(filename)
+
+	cacheFilename = SCORE_CACHE_PATH + "v" + str(PARSER_VERSION) + "-" + fileHash + ".npz"
+
+	if os.path.exists(cacheFilename):
+		cached = np.load(cacheFilename)
+		return Score(cached['name'].item(),cached['notes'],cached['length'].item(),cached['key'].tolist() or None,cached['ticksPerMeasure'].item())
+
+	score = parseMidi(filename,True)
+
+	# write to a temp file first so other workers never see a half written score
+	makeDirs(SCORE_CACHE_PATH)
+	tempFilename = getTempFilename(cacheFilename)
+	with open(tempFilename, "wb") as f:
+		np.savez(f, notes=score.notes, length=score.length, name=score.name, key=np.array(score.key or []), ticksPerMeasure=score.ticksPerMeasure)
+	os.rename(tempFilename, cacheFilename)
+
+	return score
+
+class NoteStore:
+	'''every song's note table packed into one memory mapped file, with an index of where each song's notes are'''
+
+	def __init__(self, path):
+
+		# the notes file named by the index we read last, if it was missing
+		missing = None
+
+		while True:
+
+			# the parser version the store was built with, the name and length of its notes file,
+			# and (name, length, key, ticks per measure, offset, count) for each song, by midi file hash
+			with open(path + ".idx", "rb") as f:
+				saved = pickle.load(f)
+
+			# stores built before the index named its notes file kept them in a file of their own that
+			# could be swapped in without the index, so they count as from parser version 0 and are never used
+			if not isinstance(saved, tuple) or len(saved) != 4:
+				self.version, self.index, self.notes = 0, {}, None
+				return
+
+			self.version, notesName, numNotes, self.index = saved
+			notesFilename = os.path.join(os.path.dirname(path), notesName)
+
+			# a build swapping in between reading the index and mapping the notes removes the old notes,
+			# so read the new index, unless the index still names the missing file
+			if os.path.exists(notesFilename) or notesName == missing:
+				break
+			missing = notesName
+
+		# the notes of every song, end to end, read straight from the page cache
+		self.notes = np.load(notesFilename, mmap_mode='r')
+
+		# notes that don't match the index are no use either
+		if len(self.notes) != numNotes:
+			self.version = 0
+
+	def getScore(self, filename):
+		'''returns the score for a midi file with a view into the store as its note table, or None if the file isn't stored'''
+
+		# look the song up by its contents, so a changed file is parsed again
+		fileHash = getFileHash(filename)
+
+		if fileHash not in self.index:
+			return None
+
+		name, length, songKey, ticksPerMeasure, offset, count = self.index[fileHash]
+
+		return Score(name,self.notes[offset:offset + count],length,songKey,ticksPerMeasure)
+
+	def __len__(self):
+		return len(self.index)
+
+def removeNoteFiles(path, keep=None):
+	'''removes the notes files of a note store's earlier builds, all but keep'''
+
+	folder = os.path.dirname(path) or "."
+	prefix = os.path.basename(path) + "-"
+
+	for name in os.listdir(folder):
+		if name != keep and (name == os.path.basename(path) + ".npy" or (name.startswith(prefix) and name.endswith(".npy"))):
+			os.remove(os.path.join(folder, name))
+
+def buildNoteStore(path, filenames):
+	'''packs the parsed notes of a list of midi files into a note store'''
+
+	tempPath = getTempFilename(path)
+
+	# parse every file (or load it from the score cache) once, appending its notes end to end
+	# to a raw file, so only one song's notes are in memory at a time
+	index = {}
+	offset = 0
+	with open(tempPath + ".raw", "wb") as raw:
+		for filename in filenames:
+			fileHash = getFileHash(filename)
+			if fileHash in index:
+				continue
+			score = loadScore(filename,fileHash)
+			index[fileHash] = (score.name,score.length,score.key,score.ticksPerMeasure,offset,len(score.notes))
+			score.notes.tofile(raw)
+			offset += len(score.notes)
+
+	# an empty file can't be memory mapped, so there's no store, and an older one would be stale
+	if offset == 0:
+		os.remove(tempPath + ".raw")
+		if os.path.exists(path + ".idx"):
+			os.remove(path + ".idx")
+		removeNoteFiles(path)
+		return 0
+
+	# the notes file is named for what's in it, so a build never writes over notes an index points to
+	buildId = hashlib.sha1(pickle.dumps((PARSER_VERSION,sorted(index.items())), pickle.HIGHEST_PROTOCOL)).hexdigest()
+	notesName = os.path.basename(path) + "-" + buildId[:16] + ".npy"
+
+	# give the notes an npy header so the store can be memory mapped with np.load
+	notes = np.memmap(tempPath + ".raw", dtype=NOTE_DTYPE, mode='r')
+	np.save(tempPath + ".npy", notes)
+	del notes
+	os.remove(tempPath + ".raw")
+	os.rename(tempPath + ".npy", os.path.join(os.path.dirname(path), notesName))
+
+	with open(tempPath + ".idx", "wb") as f:
+		pickle.dump((PARSER_VERSION,notesName,offset,index), f, pickle.HIGHEST_PROTOCOL)
+
+	# renaming the index over the old one swaps in the whole store at once,
+	# then the notes of earlier builds can go, readers that already mapped them keep them until they close
+	os.rename(tempPath + ".idx", path + ".idx")
+	removeNoteFiles(path, notesName)
+
+	return len(index)
+
+# the note store built by build_note_store.py, if there is one
+NOTE_STORE_PATH = "corpus_notes"
+noteStore = None
+
+def getScore(filename):
+	'''returns the score for a midi file from the note store, falling back on the score cache and the parser'''
+
+	if noteStore is not None:
+		score = noteStore.getScore(filename)
+		if score is not None:
+			return score
+
+	return loadScore(filename)
+
+# a spelled pitch is a tuple of
+# (midi pitch, step letter (C=0 ... B=6), alteration, diatonic note number, position on the line of fifths)
+
+# the spellings music21 tries for each pitch class as (step letter, alteration, octave shift)
+# its default spelling first, then the enharmonics on the letters above and below
+PITCH_SPELLINGS = [
+	[(0,0,0),(1,-2,0),(6,1,-1)],	# C, D--, B#
+	[(0,1,0),(1,-1,0),(6,2,-1)],	# C#, D-, B##
+	[(1,0,0),(2,-2,0),(0,2,0)],		# D, E--, C##
+	[(2,-1,0),(3,-2,0),(1,1,0)],	# E-, F--, D#
+	[(2,0,0),(3,-1,0),(1,2,0)],		# E, F-, D##
+	[(3,0,0),(4,-2,0),(2,1,0)],		# F, G--, E#
+	[(3,1,0),(4,-1,0),(2,2,0)],		# F#, G-, E##
+	[(4,0,0),(5,-2,0),(3,2,0)],		# G, A--, F##
+	[(4,1,0),(5,-1,0)],				# G#, A-
+	[(5,0,0),(6,-2,0),(4,2,0)],		# A, B--, G##
+	[(6,-1,0),(0,-2,1),(5,1,0)],	# B-, C--, A#
+	[(6,0,0),(0,-1,1),(5,2,0)],		# B, C-, A##
+]
+
+# position of each natural step letter on the line of fifths (C=0, G=1, D=2 ...)
+STEP_FIFTHS = [0,2,4,-1,1,3,5]
+
+def getSpellings(p):
+	'''returns the spelled pitches music21 considers for a midi pitch, default spelling first
+
+	music21 reads a pitch below 12 as a pitch class without an octave, and every spelling of it sits in
+	the implicit octave 4, so a spelling across the C (B#, C-) moves it an octave
+	'''
+
+	spellings = []
+
+	for step, alter, octaveShift in PITCH_SPELLINGS[p % 12]:
+		if p < 12:
+			octave = 4
+			spelledPitch = 60 + p - 12 * octaveShift
+		else:
+			octave = (p // 12) - 1 + octaveShift
+			spelledPitch = p
+		spellings.append((spelledPitch, step, alter, octave * 7 + step, STEP_FIFTHS[step] + 7 * alter))
+
+	return spellings
+
+# dissonance penalty for a pythagorean interval, by (fifths, octaves)
+pythagoreanPenalties = {}
 
-	# at the end, current measure number is the length of the score in whole notes
-	length = currentMeasureNumber
+def pythagoreanPenalty(fifths, octaves):
+	'''returns the dissonance penalty of the pythagorean ratio for a number of fifths and octaves'''
 
-	# get key from file name
-	songKey = getKeyFromName(filename)
+	penaltyKey = (fifths,octaves)
 
-	# create string of letter name + mode
-	# songKey = songKey[0] + " " + songKey[1]
+	if penaltyKey not in pythagoreanPenalties:
 
-	# return a new score object
-	return Score(name,notes,length,songKey)
+		# stack fifths up or down then move by octaves
+		if fifths >= 0:
+			ratio = Fraction(3,2) ** fifths
+		else:
+			ratio = Fraction(2,3) ** (-fifths)
+		ratio = ratio * Fraction(2,1) ** octaves
+
+		# the complexity of the ratio, scaled so a diminished second is 1
+		pythagoreanPenalties[penaltyKey] = math.log(ratio.numerator * ratio.denominator / ratio) / 26.366694928034633
+
+	return pythagoreanPenalties[penaltyKey]
+
+def dissonanceScore(spelled):
+	'''scores how dissonant a spelling of a chord is, following music21's pitch._dissonanceScore'''
+
+	numPitches = float(len(spelled))
+
+	# double accidentals per pitch
+	scoreAccidentals = sum(abs(p[2]) for p in spelled if abs(p[2]) > 1) / numPitches
+
+	# pythagorean ratio complexity per pitch
+	scoreRatio = 0.0
+	for p1, p2 in itertools.combinations(spelled, 2):
+
+		semitones = p2[0] - p1[0]
+		fifths = p2[4] - p1[4]
+
+		# music21 can't name intervals this far up the line of fifths
+		if fifths >= 34:
+			return float("inf")
+
+		# and wraps the names this far down it
+		if fifths <= -30:
+			fifths += 36
+
+		scoreRatio += pythagoreanPenalty(fifths, int((semitones - 7 * fifths) / 12.0))
+
+	scoreRatio = scoreRatio / numPitches
+
+	# thirds (and sixths) that can form a triad per pitch
+	scoreTriad = 0.0
+	for p1, p2 in itertools.combinations(spelled, 2):
+
+		steps = p2[3] - p1[3]
+		if steps >= 0:
+			genericValue = (steps + 1) % 8
+		else:
+			genericValue = (1 - steps) % 8
+		semitones = (p2[0] - p1[0]) % 12
+
+		if genericValue == 3 and semitones in [3,4]:
+			scoreTriad -= 1.0
+		elif genericValue == 6 and semitones in [8,9]:
+			scoreTriad -= 1.0
+
+	scoreTriad /= numPitches
+
+	return (scoreAccidentals + scoreRatio + scoreTriad) / 3
+
+def spellChord(notes):
+	'''spells a low -> high list of midi pitches the way music21 simplifies the enharmonics of a chord'''
+
+	candidates = [getSpellings(p) for p in notes]
+
+	# the first pitch keeps its default spelling
+	spelled = [candidates[0][0]]
+
+	# small chords try every combination of spellings for the other pitches
+	# the first lowest scoring combination wins
+	if len(notes) < 5:
+		best = None
+		for combination in itertools.product(*candidates[1:]):
+			score = dissonanceScore(spelled + list(combination))
+			if best is None or score < bestScore:
+				best = list(combination)
+				bestScore = score
+		return spelled + best
+
+	# bigger chords are spelled greedily, low to high
+	for pitchCandidates in candidates[1:]:
+		best = None
+		for candidate in pitchCandidates:
+			score = dissonanceScore(spelled + [candidate])
+			if best is None or score < bestScore:
+				best = candidate
+				bestScore = score
+		spelled = spelled + [best]
+
+	return spelled
+
+def getWrittenLowerNote(p1, p2):
+	'''returns the lower of two spelled pitches by step letter and octave, then by actual pitch'''
+
+	if p1[3] != p2[3]:
+		if p1[3] < p2[3]:
+			return p1
+		return p2
+
+	if p2[0] < p1[0]:
+		return p2
+	return p1
+
+def getBass(spelled):
+	'''returns the written lowest of a list of spelled pitches'''
+
+	bass = spelled[0]
+	for p in spelled[1:]:
+		bass = getWrittenLowerNote(bass, p)
+
+	return bass
+
+def findRoot(spelled):
+	'''finds the root of a spelled chord by looking for the pitch with the most thirds stacked above it'''
+
+	# keep the first pitch on each step letter
+	steps = []
+	closedPitches = []
+	for p in spelled:
+		if p[1] not in steps:
+			steps.append(p[1])
+			closedPitches.append(p)
+
+	# one step letter, the first pitch is the root
+	if len(closedPitches) == 1:
+		return spelled[0]
+
+	# pitches with a full stack of thirds above them, and a rootness score for each pitch
+	stacked = []
+	scores = []
+
+	for i in range(len(closedPitches)):
+
+		# is there a 3rd, 5th, 7th, 9th, 11th and 13th above this pitch
+		thirds = [(steps[i] + stepsAbove) % 7 in steps for stepsAbove in (2,4,6,1,3,5)]
+
+		# the other pitches all stack in thirds above this one
+		if False not in thirds[:len(closedPitches) - 1]:
+			stacked.append(i)
+
+		# lower thirds are worth more than higher ones
+		score = 0
+		for j in range(len(thirds)):
+			if thirds[j]:
+				score += 1.0 / (j + 6)
+		scores.append(score)
+
+	# one pitch with stacked thirds is the root
+	if len(stacked) == 1:
+		return closedPitches[stacked[0]]
+
+	# if they all stack, take the bass
+	elif len(stacked) == len(closedPitches):
+		return getBass(closedPitches)
+
+	# otherwise take the first highest scoring pitch
+	return closedPitches[scores.index(max(scores))]
+
+def getChordSteps(spelled,root):
+	'''returns a dict of chord step (1-7) -> semitones above the root of each pitch on that step, in chord order'''
+
+	chordSteps = {}
+
+	for p in spelled:
+		chordStep = (p[1] - root[1]) % 7 + 1
+		chordSteps.setdefault(chordStep, []).append((p[0] - root[0]) % 12)
+
+	return chordSteps
+
+def semitonesFromChordStep(chordSteps,chordStep):
+	'''returns the semitones above the root of the first pitch on a chord step, or None'''
+
+	if chordStep in chordSteps:
+		return chordSteps[chordStep][0]
+	return None
+
+def getQuality(chordSteps):
+	'''returns major, minor, diminished, augmented or other for the triad in a chord'''
+
+	third = semitonesFromChordStep(chordSteps,3)
+	fifth = semitonesFromChordStep(chordSteps,5)
+
+	# no third, or thirds of different sizes
+	if third is None or len(set(chordSteps[3])) > 1:
+		return "other"
+
+	# incomplete triads are major or minor
+	elif fifth is None:
+		if third == 4:
+			return "major"
+		elif third == 3:
+			return "minor"
+		else:
+			return "other"
+
+	# fifths of different sizes
+	elif len(set(chordSteps[5])) > 1:
+		return "other"
+
+	elif fifth == 7 and third == 4:
+		return "major"
+	elif fifth == 7 and third == 3:
+		return "minor"
+	elif fifth == 8 and third == 4:
+		return "augmented"
+	elif fifth == 6 and third == 3:
+		return "diminished"
+	else:
+		return "other"
+
+def pitchClassFromName(name):
+	'''returns the pitch class of a note name like "C", "F#" or "E-"'''
+
+	pc = [0,2,4,5,7,9,11]["CDEFGAB".index(name[0].upper())]
+
+	# sharps raise and flats lower
+	for accidental in name[1:]:
+		if accidental == "#":
+			pc += 1
+		elif accidental == "-" or accidental == "b":
+			pc -= 1
+
+	return pc % 12
+
+# chord qualities, in the order they're numbered in chord codes
+CHORD_QUALITIES = ["maj","maj7","7","min","minmaj7","min7","dim","hdim7","dim7","aug","sus4","sus2","5"]
+
+# bump whenever getChordCode or CHORD_QUALITIES change, so chords labeled by an older classifier aren't reused
+CLASSIFIER_VERSION = 2
+
+# chord code for no chord
+NO_CHORD = -1
+
+def getChordCode(notes):
+	'''labels a low -> high list of midi pitches with a code for its root pitch class, quality and bass pitch class'''
+
+	# if the note set is empty
+	if len(notes) == 0 or len(notes) == 1:
+
+		# no chord
+		return NO_CHORD
+
+	# spell the chord, then get the root and the bass
+	spelled = spellChord(notes)
+	root = findRoot(spelled)
+	bass = getBass(spelled)
+
+	# get the chord steps above the root and the quality of the chord
+	# (major, minor, diminished, augmented)
+	chordSteps = getChordSteps(spelled,root)
+	quality = getQuality(chordSteps)
+
+	# the 2nd, 4th, 5th and 7th above the root
+	second = semitonesFromChordStep(chordSteps,2)
+	fourth = semitonesFromChordStep(chordSteps,4)
+	fifth = semitonesFromChordStep(chordSteps,5)
+	seventh = semitonesFromChordStep(chordSteps,7)
+
+	# if the quality is missing, we don't have a third, basically
+	if quality == "other":
+
+		# no fifth, it's some weird chord we can't name...
+		if fifth != 7:
+			q = "none"
+		# with a 1 4 5 we have a sus4 chord
+		elif fourth == 5:
+			q = "sus4"
+		# with a 1 2 5 we have a sus2 chord
+		elif second == 2:
+			q = "sus2"
+		# if neither of these sus chords, call it a 5 chord
+		else:
+			q = "5"
+
+	# major, with a major 7th, minor 7th or no (or some weird) 7th
+	elif quality == "major":
+		q = {11: "maj7", 10: "7"}.get(seventh, "maj")
+
+	# minor
+	elif quality == "minor":
+		q = {11: "minmaj7", 10: "min7"}.get(seventh, "min")
+
+	# diminished, with a minor 7th (half diminished) or a dim 7th
+	elif quality == "diminished":
+		q = {10: "hdim7", 9: "dim7"}.get(seventh, "dim")
+
+	# augmented, we dont really care about 7s in augmented chords
+	else:
+		q = "aug"
+
+	# if we couldnt get a good quality tag return no chord
+	if q == "none":
+		return NO_CHORD
+
+	return ((root[0] % 12) * len(CHORD_QUALITIES) + CHORD_QUALITIES.index(q)) * 12 + bass[0] % 12
+
+def getChordName(code,key):
+	'''names a chord code as root:quality/bass, with the root relative to the song key and the bass to the root'''
+
+	if code == NO_CHORD:
+		return "NC"
+
+	# unpack the root, quality and bass
+	rootPc = code // 12 // len(CHORD_QUALITIES)
+	q = CHORD_QUALITIES[(code // 12) % len(CHORD_QUALITIES)]
+	bassPc = code % 12
+
+	# get root as number in terms of song key, and bass in terms of the root
+	root_num = (rootPc - pitchClassFromName(key[0])) % 12
+	bass_num = (bassPc - rootPc) % 12
+
+	return str(root_num) + ":" + q + "/" + str(bass_num)
 
 def getChord(notes,key):
+	'''names the chord for a low -> high list of midi pitches as root:quality/bass relative to the song key'''
+
+	return getChordName(getChordCode(notes),key)
+
+def getChordMusic21(notes,key):
+	'''reference implementation of getChord using music21, used to verify it'''
+
+	# music21 takes seconds to import, so only the verification pays for it
+	import music21
 
 	# if the note set is empty
 	if len(notes) == 0 or len(notes) == 1:
@@ -334,122 +1004,263 @@ def getChord(notes,key):
 	# return the chord name string
 	return chordName
 
-def getHarmony(score,unitSize):
-	'''gets unitized harmony for a score, given a unit size'''
+class ChordCache:
+	'''bounded least recently used table of chord codes in front of getChordCode, saved between runs'''
 
-	# get the notes of the score
-	notes = score.notes
+	def __init__(self, maxSize):
+		self.maxSize = maxSize
+		self.codes = OrderedDict()
+		self.added = []
+		self.hits = 0
+		self.misses = 0
 
-	songKey = score.key
+	def getChordCode(self, notes):
+		'''returns the chord code for a sorted list of pitches, labeling it with getChordCode on a miss'''
 
-	# create a list of notes still on
-	stillOn = []
+		# moving a whole voicing by octaves doesn't change its spelling, root or bass pitch class,
+		# so voicings are stored from the bottom octave and the code doesn't depend on the key
+		# (from octave 0, octave -1 is left to voicings with pitches below 12, which spell differently, see getSpellings)
+		if len(notes) > 0 and notes[0] >= 12:
+			shift = 12 * (notes[0] // 12) - 12
+		else:
+			shift = 0
+		cacheKey = tuple([p - shift for p in notes])
 
-	# round length up to nearest whole note
-	length = int(np.ceil(score.length))
+		if cacheKey in self.codes:
 
-	# the unitized score to be output
-	unitized = []
+			# move the entry to the most recently used end
+			code = self.codes.pop(cacheKey)
+			self.codes[cacheKey] = code
+			self.hits += 1
 
-	# iterate through units
-	for unitIndex in np.arange(0,length,unitSize):
+		else:
 
-		# find all notes with start in this unit
-		currUnit = filter(lambda n: n.start >= unitIndex and n.start < unitIndex + unitSize, notes)
+			code = getChordCode(notes)
+			self.store(cacheKey,code)
+			self.added.append((cacheKey,code))
+			self.misses += 1
 
-		# add any notes still on to current unit
-		currUnit += stillOn
+		return code
 
-		# clear the still on list
-		stillOn = []
+	def getChord(self, notes, key):
+		'''returns the chord name for a sorted list of pitches in a key'''
 
-		# create a empty chord notes dictionary
-		unitNotes = {}
+		return getChordName(self.getChordCode(notes),key)
 
-		# for each note on in the current unit
-		for note in currUnit:	
+	def store(self, cacheKey, code):
+		'''stores a code for a bottom octave voicing, evicting the least recently used entry if we're over size'''
 
-			# if the note did not end in this unit
-			if note.duration > unitSize:
+		self.codes[cacheKey] = code
 
-				# subtract unitSize from its duration
-				newDuration = note.duration - unitSize
+		if len(self.codes) > self.maxSize:
+			self.codes.popitem(last=False)
 
-				# create a new note with the updated duration and add it to still on
-				stillOn.append(Note(note.pitch,note.start,newDuration,note.channel))
+	def takeAdded(self):
+		'''returns the entries labeled since the last call, so a worker can hand them back to the main process'''
 
-				# set the note's duration in the current unit to the unit size
-				currDuration = unitSize
+		added = self.added
+		self.added = []
+		return added
 
-			# if the newDuration is negative, the note doesn't occupy the whole unit
-			# the note doesn't get added to still on
-			# and the notes current duration is its full duration
-			else:
+	def load(self, filename):
+		'''loads a saved table, if there is one, returning False if it's from an older chord classifier'''
 
-				# the note's duration ends in the unit
-				currDuration = note.duration
+		if not os.path.exists(filename):
+			return True
 
-			# create dictionary key for note with channel,pitch
-			dictKey = (note.channel,note.pitch)
+		with open(filename, "rb") as f:
+			saved = pickle.load(f)
 
-			# if we've seen a note with this key
-			if dictKey in unitNotes.keys():
+		# tables saved before they had a version are a bare list of entries
+		if not isinstance(saved, tuple) or saved[0] != CLASSIFIER_VERSION:
+			return False
 
-				# increase its duration accordingly
-				unitNotes[dictKey] += currDuration
+		for cacheKey, code in saved[1]:
+			self.store(cacheKey,code)
 
-			else:
-				# otherwise, add the note to the chordNotes dict
-				unitNotes[dictKey] = currDuration
+		return True
+
+	def save(self, filename):
+		'''saves the table with the classifier version, least recently used entries first'''
+
+		tempFilename = getTempFilename(filename)
+		with open(tempFilename, "wb") as f:
+			pickle.dump((CLASSIFIER_VERSION,self.codes.items()), f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tempFilename, filename)
+
+	def __str__(self):
+		s = "chord cache: " + str(len(self.codes)) + "/" + str(self.maxSize) + " entries"
+		s += ", " + str(self.hits) + " hits, " + str(self.misses) + " misses"
+		return s
 
-		#create an empty list of chord notes
-		chordNotes = []
+# the chord cache, one per process so it lives across the files a worker handles
+# the main process loads it before starting the workers and saves it with everything they labeled
+CHORD_CACHE_SIZE = 50000
+CHORD_CACHE_FILE = "chord_table.pkl"
+chordCache = ChordCache(CHORD_CACHE_SIZE)
 
-		# for each key in the unit notes dictionary
-		for k in unitNotes.keys():
+# unit sizes are whole notes, read as fractions with at most this denominator
+MAX_UNIT_DENOMINATOR = 1000
 
-			# get the channel and pitch from the key
-			# get duration from dict entry
-			# use start of unit as start of note
-			channel = k[0]
-			pitch = k[1]
-			duration = unitNotes[k]
-			start = unitIndex
+def getUnitTicks(score,unitSize):
+	'''returns a unit size in the ticks of a score, as (scale, unit ticks)
 
-			# if the duration is greater than or equal to half the unit size
-			if duration >= (unitSize / 2.0):
+	unit ticks is a whole number of ticks scaled by scale, scale is 1 unless the unit
+	doesn't divide the score's measures into whole ticks (a triplet unit in a file with 4 ticks per beat)
+	'''
 
-				# add a new note with its cumulative duration in the current unit to the chord note list
-				chordNotes.append(Note(pitch,start,duration,channel))	
+	unitTicks = Fraction(unitSize).limit_denominator(MAX_UNIT_DENOMINATOR) * score.ticksPerMeasure
 
-		# change chordNotes to be just the pitches
-		chordNotes = map(lambda n: n.pitch, chordNotes)
+	return unitTicks.denominator, unitTicks.numerator
 
-		# remove duplicates by casting to a set and back to a list
-		chordNotes = list(set(chordNotes))
+def getMeasureLength(score):
+	'''returns the length of a score in ticks, rounded up to the nearest whole note'''
 
-		# sort notes low to high
-		chordNotes.sort()
+	return -(-score.length // score.ticksPerMeasure) * score.ticksPerMeasure
 
-		# find the chord for the list of chord note pitches
-		# chord name works better when pitches are sorted low -> high
-		chordName = getChord(chordNotes,songKey)
+def getUnitBins(starts,length,unitTicks):
+	'''returns the unit starts for a unit size and the index of the unit each note start falls in, all in ticks'''
 
-		# change chordNotes to be just the pitch names
-		chordNotes = map(lambda p: music21.pitch.Pitch(p).nameWithOctave, chordNotes)
+	# the start of each unit, up to the length of the song
+	unitStarts = np.arange(0,length,unitTicks)
 
-		chordNotes = " ".join(chordNotes)
+	# a note falls in the unit it starts in
+	# notes starting after the last unit get an index past the end
+	bins = starts // unitTicks
 
-		# create a new harmony unit with the notes and the chord name
-		newHarmUnit = HarmUnit(chordNotes,chordName)
+	return unitStarts, bins
 
-		# append the chord to the unitzed list
-		unitized.append(newHarmUnit)
+def getCarries(durations,unitTicks):
+	'''returns the number of units each note carries on into after the one it starts in'''
 
-	# return the unitized list
-	return unitized
+	# a note carries on while its remaining duration is longer than a unit
+	return np.maximum((durations - 1) // unitTicks, 0)
 
-def getMelody(score,unitSize):
+def getUnitDurations(starts,durations,pairIndex,numPairs,length,unitTicks):
+	'''returns a units x (channel,pitch) pairs array of how many ticks each pair sounds in each unit
+
+	a note's duration in a unit is how much of the unit it overlaps
+	'''
+
+	unitStarts, bins = getUnitBins(starts,length,unitTicks)
+	numUnits = len(unitStarts)
+
+	ends = starts + durations
+
+	# the last unit each note overlaps, the first one that ends at or after the note does
+	lastBins = np.maximum((ends - 1) // unitTicks, bins)
+	counts = lastBins - bins + 1
+
+	# one entry per note per unit it overlaps, in note order
+	noteIndex = np.repeat(np.arange(len(starts)), counts)
+	carried = np.arange(len(noteIndex)) - np.repeat(np.cumsum(counts) - counts, counts)
+	unitIndex = bins[noteIndex] + carried
+
+	# the overlap of the note with each unit, with the same unit boundaries as getUnitBins
+	unitBegins = unitIndex * unitTicks
+	unitDurations = np.minimum(ends[noteIndex], unitBegins + unitTicks) - np.maximum(starts[noteIndex], unitBegins)
+	unitDurations = np.maximum(unitDurations, 0)
+
+	# drop anything past the last unit
+	keep = unitIndex < numUnits
+
+	# sum durations per unit and pair
+	flatIndex = unitIndex[keep] * numPairs + pairIndex[noteIndex[keep]]
+	sums = np.bincount(flatIndex, weights=unitDurations[keep], minlength=numUnits * numPairs)
+
+	return sums.astype(np.int64).reshape((numUnits,numPairs))
+
+def getHarmonies(score,unitSizes):
+	'''gets unitized harmony for a score at every unit size from one sort of its note table'''
+
+	# get the notes of the score, sorted once by start for every unit size
+	notes = getNoteTable(score)
+	notes = notes[np.argsort(notes['start'], kind='mergesort')]
+
+	songKey = score.key
+
+	# round length up to nearest whole note
+	length = getMeasureLength(score)
+
+	# number the (channel,pitch) pairs in the song
+	pairs, pairIndex = np.unique(notes['channel'].astype(np.int64) * 128 + notes['pitch'], return_inverse=True)
+
+	# a pairs x pitches matrix to merge pairs with the same pitch
+	pairPitches = np.zeros((len(pairs),128), dtype=np.int64)
+	pairPitches[np.arange(len(pairs)), pairs % 128] = 1
+
+	# one harmony unit for each pitch set, shared between units and unit sizes
+	harmUnits = {}
+
+	# the unitized scores to be output, by unit size
+	harmonies = {}
+
+	for unitSize in unitSizes:
+
+		scale, unitTicks = getUnitTicks(score,unitSize)
+		unitDurations = getUnitDurations(notes['start'] * scale,notes['duration'] * scale,pairIndex,len(pairs),length * scale,unitTicks)
+
+		# keep the pitches that sound for at least half the unit
+		sounding = np.dot((unitDurations * 2 >= unitTicks).astype(np.int64), pairPitches) > 0
+
+		unitized = []
+
+		for unitPitches in sounding:
+
+			# sorted low to high
+			chordNotes = tuple(np.flatnonzero(unitPitches).tolist())
+
+			if chordNotes not in harmUnits:
+
+				# find the chord for the list of chord note pitches
+				# chord name works better when pitches are sorted low -> high
+				chordName = chordCache.getChord(list(chordNotes),songKey)
+
+				# change chordNotes to be just the pitch names
+				noteNames = " ".join([HARMONY_PITCH_NAMES[p] for p in chordNotes])
+
+				# create a harmony unit with the notes and the chord name
+				harmUnits[chordNotes] = HarmUnit(noteNames,chordName)
+
+			unitized.append(harmUnits[chordNotes])
+
+		harmonies[unitSize] = unitized
+
+	# return the unitized lists
+	return harmonies
+
+def getHarmony(score,unitSize):
+	'''gets unitized harmony for a score, given a unit size'''
+
+	return getHarmonies(score,[unitSize])[unitSize]
+
+def getHarmonyAt(score,unitIndex,unitSize):
+	'''gets the harmony unit at one unit of a score without unitizing the rest, e.g. the chord at measure 37 is getHarmonyAt(score,36,1)
+
+	matches unit unitIndex of getHarmony(score,unitSize)
+	'''
+
+	index = getNoteIndex(score)
+	scale, unitTicks = getUnitTicks(score,unitSize)
+	unitStart = unitIndex * unitTicks
+
+	# the notes sounding in the unit, widened to whole ticks, and how much of the unit each overlaps
+	notes = index.notes[index.getSounding(unitStart // scale, -(-(unitStart + unitTicks) // scale))]
+	starts = notes['start'] * scale
+	ends = starts + notes['duration'] * scale
+	unitDurations = np.maximum(np.minimum(ends, unitStart + unitTicks) - np.maximum(starts, unitStart), 0)
+
+	# sum per (channel,pitch) pair, keeping the pitches that sound for at least half the unit
+	pairDurations = np.bincount(notes['channel'].astype(np.int64) * 128 + notes['pitch'], weights=unitDurations, minlength=16 * 128)
+	chordNotes = sorted(set((np.flatnonzero(pairDurations * 2 >= unitTicks) % 128).tolist()))
+
+	noteNames = " ".join([HARMONY_PITCH_NAMES[p] for p in chordNotes])
+	chordName = chordCache.getChord(chordNotes,score.key)
+
+	return HarmUnit(noteNames,chordName)
+
+def getMelodies(score,unitSizes,melodyChannels=3):
+	'''gets unitized melody for a score at every unit size, taking the melody from one channel or a list of channels'''
 
 	# unit size of 1/16 note to match sibelius settings
 	# treat melody like monosynth, new note will overwrite previous note
@@ -459,145 +1270,182 @@ def getMelody(score,unitSize):
 	# if none, write unit as rest and clear note still on
 
 	# get the notes of the score
-	notes = score.notes
+	notes = getNoteTable(score)
 
 	# extract just the melody notes of the score
-	# ASSUME the melody is on channel 3 (this is tue for three provided examples)
-	melNotes = filter(lambda n: n.channel == 3, notes)
+	melNotes = notes[np.in1d(notes['channel'], melodyChannels)]
+	pitches = melNotes['pitch'].astype(np.int64)
+	starts = melNotes['start']
+	durations = melNotes['duration']
 
 	# round length up to nearest whole note
-	length = int(np.ceil(score.length))
+	length = getMeasureLength(score)
 
-	# create a place to store a note that's still on
-	stillOn = 0
+	# the unitized melodies to be output, by unit size
+	# (lists of strings)
+	melodies = {}
 
-	# the unitized melody to be output
-	# (a list of strings)
-	unitized = []
+	for unitSize in unitSizes:
 
-	# iterate through units
-	for unitIndex in np.arange(0,length,unitSize):
+		scale, unitTicks = getUnitTicks(score,unitSize)
+		unitStarts, bins = getUnitBins(starts * scale,length * scale,unitTicks)
+		numUnits = len(unitStarts)
 
-		# find all notes with start in this unit
-		newNotes = filter(lambda n: n.start >= unitIndex and n.start < unitIndex + unitSize, melNotes)
+		# order the notes by unit, then longest first, then earliest start, then order in the score,
+		# so the first note of each unit is the one chosen to start in it
+		order = np.lexsort((np.arange(len(melNotes)), starts, -durations, bins))
+		order = order[bins[order] < numUnits]
+		units, first = np.unique(bins[order], return_index=True)
 
-		# if newnotes contains at least 2 notes
-		if len(newNotes) > 1:
+		chosen = np.full(numUnits, -1, dtype=np.int64)
+		chosen[units] = order[first]
 
-			# sort new notes by duration (large to small) first then by start (small to large)
-			newNotes = sorted(newNotes, key=lambda n: (-n.duration, n.start))
+		# forward fill the last unit a note was chosen in, the chosen note is still on
+		# for as many units as it carries on into, unless a new note is chosen first
+		# (an index of -1 picks the "no note" entry on the end of carries)
+		unitIndex = np.arange(numUnits)
+		lastChosen = np.maximum.accumulate(np.where(chosen >= 0, unitIndex, -1))
+		lastNote = np.where(lastChosen >= 0, chosen[lastChosen], -1)
+		carries = np.append(getCarries(durations * scale,unitTicks), -1)
+		stillOn = (chosen < 0) & (unitIndex - lastChosen <= carries[lastNote])
 
-			# chosen note is the first note in the newNotes list
-			chosenNote = newNotes[0]
+		# codes into the melody unit names, onsets then continuations of each pitch, then a rest
+		codes = np.full(numUnits, 256, dtype=np.int64)
+		codes[chosen >= 0] = pitches[chosen[chosen >= 0]]
+		codes[stillOn] = 128 + pitches[lastNote[stillOn]]
 
-			# if the chosen note is longer than the unit
-			if chosenNote.duration > unitSize:
+		melodies[unitSize] = MELODY_UNIT_NAMES[codes].tolist()
 
-				# subtract unit size to get the new duration
-				newDuration = chosenNote.duration - unitSize
+	return melodies
 
-				# set still on to be a new note with updated duration
-				stillOn = Note(chosenNote.pitch, chosenNote.start, newDuration, 3)
+def getMelody(score,unitSize,melodyChannels=3):
+	'''gets unitized melody for a score, given a unit size'''
 
-			# if the note ends this unit 
-			else:
+	return getMelodies(score,[unitSize],melodyChannels)[unitSize]
 
-				# reset still on to 0
-				stillOn = 0
+# general midi puts percussion on channel 10, which is never the melody
+PERCUSSION_CHANNEL = 9
 
-			# append the chosen note to the unitzed melody
-			unitized.append(pitchStr(chosenNote.pitch) + ":+")
+def getChannelFeatures(score):
+	'''returns the channels of a score with their mean pitch, pitch range, monophony and coverage
 
-		# otherwise, if the new notes list is 1 note long, choose it as the new note
-		elif len(newNotes) == 1:
+	monophony is the time the channel sounds over the total duration of its notes, 1 if its notes never overlap
+	coverage is the time the channel sounds over the length of the song
+	'''
 
-			# chosen note is the only note in the newNotes list
-			chosenNote = newNotes[0]
+	notes = getNoteTable(score)
+	notes = notes[np.argsort(notes['start'], kind='mergesort')]
 
-			# if the chosen note is longer than the unit
-			if chosenNote.duration > unitSize:
+	channels = np.unique(notes['channel'])
 
-				# subtract unit size to get the new duration
-				newDuration = chosenNote.duration - unitSize
+	meanPitches = np.zeros(len(channels))
+	pitchRanges = np.zeros(len(channels))
+	monophony = np.zeros(len(channels))
+	coverage = np.zeros(len(channels))
 
-				# set still on to be a new note with updated duration
-				stillOn = Note(chosenNote.pitch, chosenNote.start, newDuration, 3)
+	for i, channel in enumerate(channels):
 
-			# if the note ends this unit 
-			else:
+		channelNotes = notes[notes['channel'] == channel]
+		pitches = channelNotes['pitch'].astype(np.float64)
+		starts = channelNotes['start']
+		ends = starts + channelNotes['duration']
 
-				# reset still on to 0
-				stillOn = 0
+		meanPitches[i] = pitches.mean()
+		pitchRanges[i] = pitches.max() - pitches.min()
 
-			# append the chosen note to the unitzed melody
-			unitized.append(pitchStr(chosenNote.pitch) + ":+")
+		# the time the channel sounds, each note adding only what it sounds past the notes before it
+		latestEnds = np.maximum.accumulate(np.concatenate([[starts[0]], ends[:-1]]))
+		sounding = np.maximum(ends - np.maximum(starts, latestEnds), 0).sum()
 
-		# otherwise, the newNotes list is empty, so check if there's a note still on to add
-		elif stillOn != 0:
+		monophony[i] = float(sounding) / max(channelNotes['duration'].sum(), 1)
+		coverage[i] = float(sounding) / max(score.length, 1)
 
-			# chosen note is the still on note
-			chosenNote = stillOn
+	return channels, meanPitches, pitchRanges, monophony, coverage
 
-			# if the chosen note is longer than the unit
-			if chosenNote.duration > unitSize:
+def detectMelodyChannel(score):
+	'''guesses the channel a score's melody is on, or None if it has no notes
 
-				# subtract unit size to get the new duration
-				newDuration = chosenNote.duration - unitSize
+	the melody is taken to be the highest, most monophonic channel that plays through most of the song
+	within a singable range, percussion is never the melody
+	'''
 
-				# set still on to be a new note with updated duration
-				stillOn = Note(chosenNote.pitch, chosenNote.start, newDuration, 3)
+	channels, meanPitches, pitchRanges, monophony, coverage = getChannelFeatures(score)
 
-			# if the note ends this unit 
-			else:
+	keep = channels != PERCUSSION_CHANNEL
+	if not keep.any():
+		return None
 
-				# reset still on to 0
-				stillOn = 0
+	# an octave of height, sounding the whole song, and every octave of range past two are worth about the same,
+	# a line that never overlaps itself is worth more since chords and pads are often high and play throughout
+	scores = (meanPitches - 60) / 12.0 + 3 * monophony + np.minimum(coverage, 1) - np.maximum(pitchRanges - 24, 0) / 12.0
+	scores[~keep] = -np.inf
 
-			# append the chosen note to the unitzed melody
-			unitized.append(pitchStr(chosenNote.pitch) + ":-")
+	return int(channels[np.argmax(scores)])
 
-		# there were no new notes and no notes still on, so we rest
-		else:
-			
-			# append a 0 for the unit to represent a rest
-			unitized.append("0")
+# bump whenever detectMelodyChannel changes, so channels detected by an older version are detected again
+MELODY_DETECTOR_VERSION = 1
 
-	return unitized
+# detected melody channels, by midi file hash
+MELODY_CHANNEL_FILE = "melody_channels.json"
+melodyChannels = {}
 
-def createHarmonyCSV(filename,units,unitSize,songName,songKey):
+def loadMelodyChannels(filename):
+	'''loads the melody channels detected in earlier runs, if there are any from the current detector'''
+
+	if os.path.exists(filename):
+		with open(filename, "rb") as f:
+			saved = json.load(f)
+
+		# files saved before they had a version are a bare dict of channels
+		if saved.get("detector version") == MELODY_DETECTOR_VERSION:
+			melodyChannels.update(saved["channels"])
+
+def saveMelodyChannels(filename):
+	'''saves the detected melody channels with the detector version'''
+
+	tempFilename = getTempFilename(filename)
+	with open(tempFilename, "wb") as f:
+		json.dump({"detector version": MELODY_DETECTOR_VERSION, "channels": melodyChannels}, f, indent=1, sort_keys=True)
+	os.rename(tempFilename, filename)
+
+def getMelodyChannel(filename,fileHash,score=None):
+	'''returns a midi file's melody channel, detecting it if it wasn't detected before'''
 
-	# create an empty array
-	arr = []
+	if fileHash not in melodyChannels:
+		if score is None:
+			score = getScore(filename)
+		melodyChannels[fileHash] = detectMelodyChannel(score)
 
-	# append the score info and unit size
-	arr.append([songName,songKey,"unit size: "+str(unitSize),""])
+	return melodyChannels[fileHash]
 
-	# add an empty row
-	arr.append(["","","",""])
+def createHarmonyCSV(filename,units,unitSize,songName,songKey):
+
+	# the csv is written transposed, one row per field with the units across,
+	# so each row is built straight from the units and written before the next
 
-	# add row labels
-	arr.append(["unit number","global index","chord name","notes in unit"])
+	# open a file with the filename
+	with open(filename, "wb") as f:
 
-	# for each index in unit
-	for i in range(len(units)):
+		# create a csv writer object
+		writer = csv.writer(f)
 
-		# get the harmony unit at that index
-		hUnit = units[i]
+		# score info and unit size, an empty cell, the row label, then a value for every unit
+		# unit number
+		writer.writerow([songName,"","unit number"] + [str(i) for i in xrange(len(units))])
 
-		# get the notes in the chord
-		notes = hUnit.chordNotes
+		# global index
+		writer.writerow([songKey,"","global index"] + [str(i*unitSize + 1) for i in xrange(len(units))])
 
-		# get the chord name
-		chord = hUnit.chordName
+		# chord name
+		writer.writerow(["unit size: "+str(unitSize),"","chord name"] + [hUnit.chordName for hUnit in units])
 
-		# create a row with index, chord, notes
-		row = [str(i),str(i*unitSize + 1),chord,notes]
+		# notes in the chord
+		writer.writerow(["","","notes in unit"] + [hUnit.chordNotes for hUnit in units])
 
-		# add the row to array
-		arr.append(row)
+def createMelodyCSV(filename,units,unitSize,songName,songKey):
 
-	# transpose the array
-	arr = np.transpose(arr)
+	# the csv is written transposed, one row per field with the units across,
+	# so each row is built straight from the units and written before the next
 
 	# open a file with the filename
 	with open(filename, "wb") as f:
@@ -605,148 +1453,610 @@ def createHarmonyCSV(filename,units,unitSize,songName,songKey):
 		# create a csv writer object
 		writer = csv.writer(f)
 
-		# write the array as row
-		writer.writerows(arr)
+		# score info, unit size and key to the symbols, an empty cell, the row label, then a value for every unit
+		# unit number
+		writer.writerow([songName,"unit size: ","+ for note onset","0 for rest","","unit number"] + [str(i) for i in xrange(len(units))])
 
-def createMelodyCSV(filename,units,unitSize,songName,songKey):
+		# melody note
+		writer.writerow([songKey,str(unitSize),"- for note continuation","","","melody note"] + list(units))
 
-	# create an empty array
-	arr = []
+def encodeLabels(labels):
+	'''returns a list of strings as a label column, a sorted vocabulary and the index of each string in it'''
 
-	# append the score info and unit size
-	arr.append([songName,songKey])
-	arr.append(["unit size: ",str(unitSize)])
-	arr.append(["+ for note onset","- for note continuation"])
-	arr.append(["0 for rest",""])
+	vocab, ids = np.unique(np.array(labels, dtype=np.unicode_), return_inverse=True)
 
-	# add an empty row
-	arr.append(["",""])
+	return vocab, ids.astype(np.int32)
 
-	# add row labels
-	arr.append(["unit number","melody note"])
+def decodeLabels(column):
+	'''returns the strings of a label column'''
 
-	# for each index in unit
-	for i in range(len(units)):
+	vocab, ids = column
 
-		# get the meldoy unit at that index
-		mUnit = units[i]
+	return vocab[ids].tolist()
 
-		# create a row with index, chord, notes
-		row = [str(i),mUnit]
+def mergeLabels(columns):
+	'''joins label columns end to end, with one vocabulary for all of them
 
-		# add the row to array
-		arr.append(row)
+	columns can share a vocabulary array, as every song loaded from one npz does, each distinct array is merged once
+	'''
 
-	# transpose the array
-	arr = np.transpose(arr)
+	empty = np.array([], dtype=np.unicode_)
 
-	# open a file with the filename
-	with open(filename, "wb") as f:
+	# the distinct vocabulary arrays, by identity
+	vocabs = OrderedDict()
+	for v, ids in columns:
+		vocabs.setdefault(id(v), v)
 
-		# create a csv writer object
-		writer = csv.writer(f)
+	vocab = np.unique(np.concatenate([empty] + vocabs.values()))
 
-		# write the array as row
-		writer.writerows(arr)
+	# where each vocabulary's labels are in the shared one, then move each column's ids there
+	positions = dict((key, np.searchsorted(vocab, v)) for key, v in vocabs.items())
+	ids = [positions[id(v)][i] for v, i in columns]
 
-def main():
+	return vocab, np.concatenate([np.array([], dtype=np.int32)] + ids).astype(np.int32)
 
-	HARMONY = True
-	MELODY = False
+class ChordVocabulary:
+	'''chord names numbered in the order they're first seen, with how many units have each, kept between runs'''
 
-	# # delete the out directory
-	# shutil.rmtree('../out', ignore_errors=True)
+	def __init__(self):
+		self.ids = {}
+		self.names = []
+		self.counts = []
 
-	# Set path to input midi files
-	inPath = 'GeerdesMIDI_keys/'
+	def getId(self, name):
+		'''returns the id of a chord name, numbering it if it's new'''
 
-	# get all input 
-	filelist = np.array(os.listdir(inPath))
+		if name not in self.ids:
+			self.ids[name] = len(self.names)
+			self.names.append(name)
+			self.counts.append(0)
 
-	# counter
-	i = 0
+		return self.ids[name]
 
-	# for each file in the filelist
-	for f in filelist:
+	def getIds(self, vocab):
+		'''returns the ids of an array of chord names'''
 
-		print f
-		print
+		return np.array([self.getId(name) for name in vocab.tolist()], dtype=np.int32)
+
+	def count(self, songs):
+		'''adds the chords of every song's harmony units to the counts'''
+
+		vocab, ids = mergeLabels([song["harmony"][0] for song in songs.values() if song["harmony"] is not None])
+
+		for i, n in zip(self.getIds(vocab), np.bincount(ids, minlength=len(vocab))):
+			self.counts[i] += n
+
+	def resetCounts(self):
+		self.counts = [0] * len(self.names)
+
+	def load(self, filename):
+		'''loads a saved vocabulary, if there is one'''
+
+		if os.path.exists(filename):
+			with open(filename, "rb") as f:
+				saved = json.load(f)
+			for name, n in zip(saved["names"], saved["counts"]):
+				self.counts[self.getId(name)] = n
+
+	def save(self, filename):
+		'''saves the vocabulary, in id order'''
+
+		tempFilename = getTempFilename(filename)
+		with open(tempFilename, "wb") as f:
+			json.dump({"names": self.names, "counts": self.counts}, f, indent=1)
+		os.rename(tempFilename, filename)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __str__(self):
+		return "chord vocabulary: " + str(len(self.names)) + " chords"
+
+# the chord vocabulary the npzs' chord ids index, shared by every unit size and run
+CHORD_VOCAB_FILE = "chord_vocab.json"
+chordVocab = ChordVocabulary()
+
+def saveUnits(filename,songs):
+	'''writes the units of every song at one unit size to an npz, with integer labels and a vocabulary for each kind of label
+	chords are numbered by the chord vocabulary, which must already have every song's chords'''
+
+	files = sorted(songs)
+
+	# a song's units are rows offsets[i] to offsets[i+1] of each column
+	hasHarmony = []
+	harmonyOffsets = [0]
+	chords = []
+	notes = []
+	hasMelody = []
+	melodyOffsets = [0]
+	melody = []
+	for f in files:
+		song = songs[f]
+
+		hasHarmony.append(song["harmony"] is not None)
+		if song["harmony"] is not None:
+			chords.append(song["harmony"][0])
+			notes.append(song["harmony"][1])
+			harmonyOffsets.append(harmonyOffsets[-1] + len(song["harmony"][0][1]))
+		else:
+			harmonyOffsets.append(harmonyOffsets[-1])
+
+		hasMelody.append(song["melody"] is not None)
+		if song["melody"] is not None:
+			melody.append(song["melody"])
+			melodyOffsets.append(melodyOffsets[-1] + len(song["melody"][1]))
+		else:
+			melodyOffsets.append(melodyOffsets[-1])
+
+	# chords are numbered by the shared vocabulary, so ids mean the same in every npz
+	chordNames, chordIds = mergeLabels(chords)
+	chordIds = chordVocab.getIds(chordNames)[chordIds]
+	noteVocab, noteIds = mergeLabels(notes)
+	melodyVocab, melodyIds = mergeLabels(melody)
+
+	tempFilename = getTempFilename(filename)
+	with open(tempFilename, "wb") as f:
+		np.savez(f,
+			songs=np.array(files, dtype=np.unicode_),
+			names=np.array([songs[g]["name"] for g in files], dtype=np.unicode_),
+			keys=np.array([songs[g]["key"] for g in files], dtype=np.unicode_),
+			hasHarmony=np.array(hasHarmony, dtype=np.bool_),
+			harmonyOffsets=np.array(harmonyOffsets, dtype=np.int64),
+			chords=chordIds,
+			chordVocab=np.array(chordVocab.names, dtype=np.unicode_),
+			chordCounts=np.bincount(chordIds, minlength=len(chordVocab)),
+			notes=noteIds,
+			noteVocab=noteVocab,
+			hasMelody=np.array(hasMelody, dtype=np.bool_),
+			melodyOffsets=np.array(melodyOffsets, dtype=np.int64),
+			melody=melodyIds,
+			melodyVocab=melodyVocab)
+	os.rename(tempFilename, filename)
+
+def loadUnits(filename):
+	'''loads the units of every song at one unit size from an npz, if there is one'''
+
+	songs = {}
 
-		# get the file extension
-		fileExt = f.split(".")[-1]
+	if not os.path.exists(filename):
+		return songs
 
-		# if it's midi file
-		if fileExt.lower() == "mid":
+	data = np.load(filename)
 
-			#get the filename:
-			filename = inPath + f
+	harmonyOffsets = data['harmonyOffsets']
+	melodyOffsets = data['melodyOffsets']
+	chords = data['chords']
+	notes = data['notes']
+	melody = data['melody']
 
-			# parse the file to create a score
-			print "Parsing MIDI file..."
-			score = parseMidi(filename)
+	# the npz reads an array from the file every time it's asked for one, so read each vocabulary once
+	chordVocabulary = data['chordVocab']
+	noteVocab = data['noteVocab']
+	melodyVocab = data['melodyVocab']
+	names = data['names']
+	keys = data['keys']
+	hasHarmony = data['hasHarmony']
+	hasMelody = data['hasMelody']
 
-			# get the song name and key from score object
-			songName = score.name
-			songKey = score.key
-			songKey = songKey[0] + " " + songKey[1]
+	for i, f in enumerate(data['songs'].tolist()):
 
-			# unitsizes array
-			# 1/16, 1/8, 1/4, 1/2, 1, 2, 4
-			################# PUT THIS BACK ###################
-			unitSizes = [0.25,0.5,0.75,1,1.5,2]
-			###################################################
+		song = {"name": names[i], "key": keys[i], "harmony": None, "melody": None}
 
+		# every song shares the vocabulary arrays, and keeps just its own slice of the ids
+		if hasHarmony[i]:
+			start, end = harmonyOffsets[i], harmonyOffsets[i+1]
+			song["harmony"] = ((chordVocabulary,chords[start:end]),(noteVocab,notes[start:end]))
 
-			# for each unit size
-			for unitSize in unitSizes:
+		if hasMelody[i]:
+			start, end = melodyOffsets[i], melodyOffsets[i+1]
+			song["melody"] = (melodyVocab,melody[start:end])
 
-				print unitSize
+		songs[f] = song
 
-				# MELODY
+	return songs
 
-				if MELODY:
-				
-					# get the melody units
-					melodyUnits = getMelody(score,unitSize)
+# output switches
+HARMONY = True
+MELODY = False
 
-					# create the output path if it doesn't exist
-					mOutPath = "out/melody/" + str(unitSize) + "/"
-					if not os.path.exists(mOutPath):
-						os.makedirs(mOutPath)
+# channels the melody is on, None to detect the melody channel of each file
+# (channel 3 is right for three provided examples)
+MELODY_CHANNELS = None
 
-					# set the full filename to save the melody data to
-					mFullFilename = mOutPath + "".join(f.split(".")) + ".csv"
+# output formats, a csv per song and unit size, and/or one npz of every song per unit size
+CSV = True
+NPZ = False
 
-					# write the melody csv
-					createMelodyCSV(mFullFilename,melodyUnits,unitSize,songName,songKey)
+# Set path to input midi files
+# files no longer need renaming by key_detection.py, the key is detected as each one is parsed
+IN_PATH = 'GeerdesMIDI/'
 
-				# HARMONY
+# unitsizes array
+# 1/16, 1/8, 1/4, 1/2, 1, 2, 4
+UNIT_SIZES = [0.25,0.5,0.75,1,1.5,2]
 
-				if HARMONY:
+# record of the processed files, so re-runs only process new or changed files and missing outputs
+MANIFEST_FILE = "manifest.json"
 
-					# get the harmony units, given the score and unit size
-					harmonyUnits = getHarmony(score,unitSize)
+def getOutputFilename(kind,unitSize,f):
+	'''returns the csv filename for a midi file's melody or harmony at a unit size'''
 
-					# create the output path if it doesn't exist
-					hOutPath = "out/harmony/" + str(unitSize) + "/"
-					if not os.path.exists(hOutPath):
-						os.makedirs(hOutPath)
+	return "out/" + kind + "/" + str(unitSize) + "/" + "".join(f.split(".")) + ".csv"
 
-					# set the full filename to save the harmony data to
-					hFullFilename = hOutPath + "".join(f.split(".")) + ".csv"
+def getUnitsFilename(unitSize):
+	'''returns the npz filename for every song's units at a unit size'''
 
-					# write the harmony csv
-					createHarmonyCSV(hFullFilename,harmonyUnits,unitSize,songName,songKey)
+	return "out/units_" + str(unitSize) + ".npz"
 
-				
-			# move the file
-			dst = "done/"
-			if not os.path.exists(dst):
-				os.makedirs(dst)
-			os.rename(filename, dst + f)
+def hasUnits(song):
+	'''checks that a song loaded from an npz has the units the current settings write'''
 
-			i += 1
-			print i
+	if song is None:
+		return False
+
+	return (not HARMONY or song["harmony"] is not None) and (not MELODY or song["melody"] is not None)
+
+def getOutputFilenames(f):
+	'''returns every csv filename the current settings write for a midi file'''
+
+	outputs = []
+
+	if not CSV:
+		return outputs
+
+	for unitSize in UNIT_SIZES:
+		if MELODY:
+			outputs.append(getOutputFilename("melody",unitSize,f))
+		if HARMONY:
+			outputs.append(getOutputFilename("harmony",unitSize,f))
+
+	return outputs
+
+def getManifestEntry(f,fileHash):
+	'''returns the manifest entry for a midi file processed with the current settings'''
+
+	outputs = {}
+	for outFilename in getOutputFilenames(f):
+		outputs[outFilename] = getFileHash(outFilename)
+
+	return {"hash": fileHash, "parser version": PARSER_VERSION, "classifier version": CLASSIFIER_VERSION, "unit sizes": UNIT_SIZES, "melody channels": MELODY_CHANNELS, "melody detector version": MELODY_DETECTOR_VERSION, "outputs": outputs}
+
+def isUpToDate(entry,f,fileHash,storedSongs):
+	'''checks a manifest entry against a midi file's contents and the current settings and outputs'''
+
+	if entry is None:
+		return False
+
+	if entry["hash"] != fileHash or entry["parser version"] != PARSER_VERSION or entry["unit sizes"] != UNIT_SIZES:
+		return False
+
+	# chord names in the harmony outputs come from the classifier
+	if HARMONY and entry.get("classifier version") != CLASSIFIER_VERSION:
+		return False
+
+	if MELODY and entry.get("melody channels") != MELODY_CHANNELS:
+		return False
+
+	# detected melody channels come from the detector
+	if MELODY and MELODY_CHANNELS is None and entry.get("melody detector version") != MELODY_DETECTOR_VERSION:
+		return False
+
+	# every output we would write must be there, unchanged since we wrote it
+	for outFilename in getOutputFilenames(f):
+		if outFilename not in entry["outputs"] or not os.path.exists(outFilename):
+			return False
+		if getFileHash(outFilename) != entry["outputs"][outFilename]:
+			return False
+
+	# and its units must be in the npzs, which check themselves when they're loaded
+	if NPZ and f not in storedSongs:
+		return False
+
+	return True
+
+# files finished since the manifest was last saved, one json line each, so a killed run can resume
+MANIFEST_JOURNAL = "manifest.journal"
+
+def loadManifest(filename,journalFilename):
+	'''loads the manifest entries by midi file name, with the files finished in an unsaved run on top'''
+
+	manifest = {}
+
+	if os.path.exists(filename):
+		with open(filename, "rb") as f:
+			manifest = json.load(f)
+
+	if os.path.exists(journalFilename):
+		with open(journalFilename, "r+b") as journal:
+
+			# where the last complete line ends
+			end = 0
+
+			for line in iter(journal.readline, ""):
+
+				# the last line is cut short if we were killed while writing it
+				if not line.endswith("\n"):
+					break
+				try:
+					midiFile, entry = json.loads(line)
+				except ValueError:
+					break
+
+				manifest[midiFile] = entry
+				end += len(line)
+
+			# drop a cut short line, so the entries this run appends don't run into it
+			journal.truncate(end)
+
+	return manifest
+
+def saveManifest(filename,manifest):
+	'''saves the manifest, sorted so it diffs cleanly between runs'''
+
+	tempFilename = getTempFilename(filename)
+	with open(tempFilename, "wb") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.rename(tempFilename, filename)
+
+def journalEntry(journal,f,entry):
+	'''appends a finished file's manifest entry to the journal, making sure it is on disk'''
+
+	journal.write(json.dumps([f,entry]) + "\n")
+	journal.flush()
+	os.fsync(journal.fileno())
+
+def processFile(f):
+	'''processes one midi file in a worker, handing back an error record instead of raising if it fails,
+	so one bad file doesn't stop the run'''
+
+	try:
+		return unitizeFile(f)
+	except Exception:
+		# no manifest entry, so the file is neither journaled nor counted as done
+		return f, traceback.format_exc(), chordCache.takeAdded(), None, {}, []
+
+def unitizeFile(f):
+	'''parses one midi file from the input folder, writes its unitized csvs and returns its units for the npzs'''
+
+	#get the filename:
+	filename = IN_PATH + f
+	fileHash = getFileHash(filename)
+
+	# parse the file to create a score, with its notes in a note table
+	# files parsed in an earlier run come straight from the note store or the score cache
+	score = getScore(filename)
+
+	# get the song name and key from score object
+	songName = score.name
+	# the key was detected when the file was parsed, a file without notes has none
+	songKey = score.key
+	if songKey is not None:
+		songKey = songKey[0] + " " + songKey[1]
+	else:
+		songKey = ""
+
+	# unitize the score at every unit size at once
+	if MELODY:
+
+		# detect the melody channel unless it's set, a file without notes has none
+		channels = MELODY_CHANNELS
+		if channels is None:
+			melodyChannel = getMelodyChannel(filename,fileHash,score)
+			channels = [melodyChannel] if melodyChannel is not None else []
+
+		melodies = getMelodies(score,UNIT_SIZES,channels)
+	if HARMONY:
+		harmonies = getHarmonies(score,UNIT_SIZES)
+
+	# the song's units for the npzs, by unit size
+	units = {}
+
+	# for each unit size
+	for unitSize in UNIT_SIZES:
+
+		# the song's entry in the unit size's npz, with its labels integer coded
+		if NPZ:
+			units[unitSize] = {"name": songName, "key": songKey, "harmony": None, "melody": None}
+
+		# MELODY
+
+		if MELODY and NPZ:
+			units[unitSize]["melody"] = encodeLabels(melodies[unitSize])
+
+		if MELODY and CSV:
+		
+			# get the melody units
+			melodyUnits = melodies[unitSize]
+
+			# set the full filename to save the melody data to
+			mFullFilename = getOutputFilename("melody",unitSize,f)
+
+			# create the output path if it doesn't exist
+			makeDirs(os.path.dirname(mFullFilename))
+
+			# write the melody csv, renaming it into place so it's never left half written
+			mTempFilename = getTempFilename(mFullFilename)
+			createMelodyCSV(mTempFilename,melodyUnits,unitSize,songName,songKey)
+			os.rename(mTempFilename, mFullFilename)
+
+		# HARMONY
+
+		if HARMONY and NPZ:
+			chordNames = encodeLabels([hUnit.chordName for hUnit in harmonies[unitSize]])
+			chordNotes = encodeLabels([hUnit.chordNotes for hUnit in harmonies[unitSize]])
+			units[unitSize]["harmony"] = (chordNames,chordNotes)
+
+		if HARMONY and CSV:
+
+			# get the harmony units for the unit size
+			harmonyUnits = harmonies[unitSize]
+
+			# set the full filename to save the harmony data to
+			hFullFilename = getOutputFilename("harmony",unitSize,f)
+
+			# create the output path if it doesn't exist
+			makeDirs(os.path.dirname(hFullFilename))
+
+			# write the harmony csv, renaming it into place so it's never left half written
+			hTempFilename = getTempFilename(hFullFilename)
+			createHarmonyCSV(hTempFilename,harmonyUnits,unitSize,songName,songKey)
+			os.rename(hTempFilename, hFullFilename)
+
+	# record the file and its outputs for the manifest, the input stays where it is
+	entry = getManifestEntry(f,fileHash)
+
+	# report the file along with this worker's chord cache counters,
+	# and hand back the chords it labeled so they can be saved
+	# hand back the melody channel too, if it was detected, so it can be saved
+	detected = [(fileHash,melodyChannels[fileHash])] if fileHash in melodyChannels else []
+
+	return f, str(chordCache), chordCache.takeAdded(), entry, units, detected
+
+def makeDirs(path):
+	'''creates a directory if it doesn't exist, tolerating other workers creating it first'''
+
+	try:
+		os.makedirs(path)
+	except OSError:
+		if not os.path.isdir(path):
+			raise
+
+def main():
+
+	global noteStore
+
+	# number of worker processes, from the command line or one per core
+	if len(sys.argv) > 1:
+		numWorkers = int(sys.argv[1])
+	else:
+		numWorkers = multiprocessing.cpu_count()
+
+	# # delete the out directory
+	# shutil.rmtree('../out', ignore_errors=True)
+
+	# get all input midi files
+	filelist = [f for f in sorted(os.listdir(IN_PATH)) if f.split(".")[-1].lower() == "mid"]
+
+	# skip the files whose outputs are up to date from an earlier run
+	# every other file goes on the queue exactly once, so workers never overlap
+	# a run that was killed left its finished files in the journal, so it picks up where it stopped
+	manifest = loadManifest(MANIFEST_FILE,MANIFEST_JOURNAL)
+
+	# every song's units from earlier runs, by unit size, and the songs that are in all of them
+	storedUnits = {}
+	storedSongs = set(filelist)
+	if NPZ:
+		chordVocab.load(CHORD_VOCAB_FILE)
+		for unitSize in UNIT_SIZES:
+			storedUnits[unitSize] = loadUnits(getUnitsFilename(unitSize))
+			storedSongs = set([f for f in storedSongs if hasUnits(storedUnits[unitSize].get(f))])
+
+	todo = [f for f in filelist if not isUpToDate(manifest.get(f),f,getFileHash(IN_PATH + f),storedSongs)]
+
+	print "Processing " + str(len(todo)) + " of " + str(len(filelist)) + " files with " + str(numWorkers) + " workers..."
+	print
+
+	# load the chords labeled in earlier runs, the workers start with a copy
+	if not chordCache.load(CHORD_CACHE_FILE):
+		print "Not using the chord table, it's from an older chord classifier, chords will be labeled again"
+		print
+
+	# and the melody channels detected in earlier runs
+	loadMelodyChannels(MELODY_CHANNEL_FILE)
+
+	# open the note store before starting the workers, so they all share its pages
+	if os.path.exists(NOTE_STORE_PATH + ".idx"):
+		noteStore = NoteStore(NOTE_STORE_PATH)
+		if noteStore.version == PARSER_VERSION:
+			print "Using note store with " + str(len(noteStore)) + " songs"
+		else:
+			print "Not using the note store, it's from an older version of parse_midi, rebuild it with build_note_store.py"
+			noteStore = None
+		print
+
+	# create the worker pool
+	# the workers are forked, so they start with everything imported and loaded so far
+	pool = multiprocessing.Pool(numWorkers)
+
+	print "Started in " + str(round(time.time() - loadStart,2)) + "s, imports took " + str(round(loadTime,2)) + "s"
+	if loadTime > STARTUP_BUDGET:
+		print "Imports are over the startup budget of " + str(STARTUP_BUDGET) + "s"
+	print
+
+	# counter
+	i = 0
+
+	# files that failed, they're retried on the next run
+	failed = []
+
+	# record each file as soon as it's done
+	journal = open(MANIFEST_JOURNAL, "ab")
+
+	# hand files out one at a time so long songs don't hold up a whole slice of the list
+	for f, report, added, entry, units, detected in pool.imap_unordered(processFile, todo, 1):
+
+		i += 1
+
+		# keep the chords the worker labeled
+		for cacheKey, code in added:
+			chordCache.store(cacheKey,code)
+
+		# a failed file reports its traceback, anything stored for it from an earlier run is out of date
+		if entry is None:
+			print str(i) + " " + f + " failed, skipping it:"
+			print report
+			failed.append(f)
+			manifest.pop(f, None)
+			for unitSize in storedUnits:
+				storedUnits[unitSize].pop(f, None)
+			for outFilename in getOutputFilenames(f):
+				if os.path.exists(outFilename):
+					os.remove(outFilename)
+			continue
+
+		print str(i) + " " + f + " (" + report + ")"
+
+		# and the melody channel it detected
+		for fileHash, melodyChannel in detected:
+			melodyChannels[fileHash] = melodyChannel
+
+		# keep the song's units for the npzs, numbering its new chords as they come in
+		for unitSize in units:
+			storedUnits[unitSize][f] = units[unitSize]
+			if units[unitSize]["harmony"] is not None:
+				chordVocab.getIds(units[unitSize]["harmony"][0][0])
+
+		# the file is done
+		manifest[f] = entry
+		journalEntry(journal,f,entry)
+
+	pool.close()
+	pool.join()
+
+	# write every song's units, one npz per unit size
+	# counting the chords first means every npz gets the whole vocabulary
+	if NPZ:
+		chordVocab.resetCounts()
+		for unitSize in UNIT_SIZES:
+			chordVocab.count(storedUnits[unitSize])
+		makeDirs("out")
+		for unitSize in UNIT_SIZES:
+			saveUnits(getUnitsFilename(unitSize),storedUnits[unitSize])
+		chordVocab.save(CHORD_VOCAB_FILE)
+		print
+		print chordVocab
+
+	# save the chords and the manifest for the next run
+	# the journal goes once everything in it is in the saved manifest
+	chordCache.save(CHORD_CACHE_FILE)
+	saveMelodyChannels(MELODY_CHANNEL_FILE)
+	saveManifest(MANIFEST_FILE,manifest)
+	journal.close()
+	os.remove(MANIFEST_JOURNAL)
+
+	if failed:
+		print
+		print str(len(failed)) + " files failed and were skipped: " + ", ".join(failed)
 
 
 if __name__ == "__main__": main()
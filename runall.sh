@@ -1,4 +1 @@
-nohup python parse_midi.py > log1.out &
-nohup python parse_midi2.py > log2.out &
-nohup python parse_midi3.py > log3.out &
-nohup python parse_midi4.py > log4.out &
+nohup python parse_midi.py 4 > log.out &
@@ -0,0 +1,56 @@
+####################################################
+# Checks the integer chord classifier in parse_midi
+# against the music21 reference implementation
+#
+# usage: python verify_chords.py [voicings per pitch class set]
+####################################################
+
+import random
+import sys
+from parse_midi import getChord, getChordMusic21
+
+# number of random voicings to try for each pitch class set
+if len(sys.argv) > 1:
+	numVoicings = int(sys.argv[1])
+else:
+	numVoicings = 3
+
+# song keys to name the chords in
+keys = [["C","major"],["E-","minor"],["F#","major"],["B-","minor"]]
+
+random.seed(0)
+
+checked = 0
+mismatches = 0
+
+# for every pitch class set with at least two pitch classes
+for mask in range(4096):
+
+	pitchClasses = [pc for pc in range(12) if mask & (1 << pc)]
+
+	if len(pitchClasses) < 2:
+		continue
+
+	for v in range(numVoicings):
+
+		# spread the pitch classes over a few octaves, sometimes doubling one
+		# octaves -1 and 0 are in the mix, music21 reads pitches below 12 as pitch classes without an octave
+		notes = [pc + 12 * random.choice([0,1,3,4,5,6]) for pc in pitchClasses]
+		if random.random() < 0.5:
+			notes.append(random.choice(pitchClasses) + 12 * random.choice([0,1,3,4,5,6]))
+
+		# chord names expect pitches sorted low to high without duplicates
+		notes = sorted(set(notes))
+
+		key = random.choice(keys)
+
+		fast = getChord(notes,key)
+		reference = getChordMusic21(notes,key)
+
+		checked += 1
+
+		if fast != reference:
+			mismatches += 1
+			print notes, key, fast, reference
+
+print str(checked) + " chords checked, " + str(mismatches) + " mismatches"
@@ -0,0 +1,47 @@
+####################################################
+# Checks the key detection in parse_midi against
+# music21's Krumhansl analysis
+#
+# the two only agree on files music21 reads the same notes from as parseMidi,
+# in practice files with quantized onsets and durations, because on import music21
+# - quantizes offsets and durations to the nearest sixteenth or triplet eighth
+# - merges notes starting together on a track into a chord with one duration
+# - pairs note offs of overlapping notes of the same pitch differently
+# so expect mismatches on unquantized files, most of all ones with flat pitch profiles
+#
+# usage: python verify_keys.py [folder of midi files]
+####################################################
+
+import os
+import sys
+import music21
+from parse_midi import parseMidi, detectKey
+
+# folder of midi files to check
+if len(sys.argv) > 1:
+	inPath = os.path.join(sys.argv[1], "")
+else:
+	inPath = "GeerdesMIDI/"
+
+checked = 0
+mismatches = 0
+
+for filename in sorted(os.listdir(inPath)):
+
+	if filename.split(".")[-1].lower() != "mid":
+		continue
+
+	# the key from the parsed notes
+	songKey = detectKey(parseMidi(inPath + filename,True))
+
+	# the key music21 finds
+	key21 = music21.converter.parse(inPath + filename).analyze('Krumhansl')
+	reference = [str(key21.tonic.name),str(key21.mode)]
+
+	checked += 1
+
+	if songKey != reference:
+		mismatches += 1
+		print filename, songKey, reference
+
+print str(checked) + " files checked, " + str(mismatches) + " mismatches"